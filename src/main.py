@@ -1,11 +1,16 @@
 from jobspy import scrape_jobs
 import pandas as pd
+import numpy as np
 from connections.neondb_client import get_neon_engine
-from sqlalchemy import create_engine, MetaData, Table, select
+from utils.pg_copy import psql_insert_copy
+from utils.gemini_cache import cache_table_name, prompt_hash, load_cached_results, save_cached_results
+from sqlalchemy import create_engine, inspect, select, text, bindparam
 import mmh3
-import requests
+import aiohttp
+import asyncio
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_random_exponential
 import time
-import json
+import orjson
 from src.config import read_config
 
 
@@ -13,16 +18,145 @@ def hash_url(url):
     return mmh3.hash(url, signed=False)
 
 
+# Elementwise ufunc over an object array of urls, skipping Series.apply's per-row bookkeeping
+_hash_url_ufunc = np.frompyfunc(hash_url, 1, 1)
+
+
+def hash_urls(urls):
+    return _hash_url_ufunc(urls).astype(np.int64)
+
+
 # Set up the GeminiPro API request
 gemini_config = read_config()['GeminiPro']
-url = "https://generativelanguage.googleapis.com/v1beta/models/gemini-pro:generateContent"
+# Any model that supports responseSchema; overridable from config.ini as models get retired
+model = gemini_config.get('model', fallback='gemini-2.5-flash')
+url = "https://generativelanguage.googleapis.com/v1beta/models/" + model + ":generateContent"
 params = {'key': gemini_config['API_KEY']}
 headers = {'Content-Type': 'application/json'}
+concurrency = 16  # max in-flight Gemini requests
+min_description_length = 50  # shorter descriptions are not worth a Gemini call
+
+fields_list = [
+    'country',
+    'state',
+    'city',
+    'desired tech skills',
+    'desired soft skills',
+    'desired domain skills',
+    'domains',
+    'company sector',
+    'position seniority level',
+    'job type',
+    'job title',
+    'job description',
+    'job requirements',
+    'job responsibilities',
+    'job benefits',
+    'salary',
+    'company name',
+    'company description',
+    'company website',
+    'company size',
+    'company industry',
+    'company headquarters',
+    'company employees',
+    'company revenue'
+]
+suffix_cols = [field.replace(" ", "_") + "_inferred" for field in fields_list]
+list_fields = {'desired tech skills', 'desired soft skills', 'desired domain skills', 'domains'}
+
+# Have Gemini answer with a JSON object of exactly these fields instead of free text
+generation_config = {
+    "responseMimeType": "application/json",
+    "responseSchema": {
+        "type": "OBJECT",
+        "properties": {
+            field: {"type": "ARRAY", "items": {"type": "STRING"}} if field in list_fields else {"type": "STRING"}
+            for field in fields_list
+        },
+    },
+}
+
+# Everything in the Gemini prompt that comes before the job text
+prompt_prefix = """  Extract and return these fields in a dictionary:
+                    1. country
+                    2.state
+                    3.city
+                    4.desired tech skills (as a list)
+                    5.desired soft skills (as a list)
+                    6.desired domain skills (as a list)
+                    7. domains (as a list)
+                    8.company sector
+                    9.position seniority level
+                    10. job type
+                    11. job title
+                    12. job description
+                    13. job requirements
+                    14. job responsibilities
+                    15. job benefits
+                    16. salary (if mentioned)
+                    18. company name (if mentioned)
+                    19. company description (if mentioned)
+                    20. company website (if mentioned)
+                    21. company size (if mentioned)
+                    22. company industry (if mentioned)
+                    23. company headquarters (if mentioned)
+                    24. company employees (if mentioned)
+                    25. company revenue (if mentioned)
+                    , from this text  - """
+
+
+def log_retry(retry_state):
+    print(f"API request failed with exception {retry_state.outcome.exception()}. Retrying...")
+
+
+# Jittered back-off so concurrent requests don't all retry at the same moment
+@retry(wait=wait_random_exponential(multiplier=1, max=60), stop=stop_after_attempt(5), before_sleep=log_retry,
+       retry=retry_if_exception_type((aiohttp.ClientError, asyncio.TimeoutError, KeyError, ValueError)), reraise=True)
+async def request_gemini(session, payload):
+    # Call Gemini API
+    start_time = time.time()  # Start timing
+    async with session.post(url, json=payload, headers=headers, params=params) as response:
+        response.raise_for_status()
+        result = orjson.loads(await response.read())
+    print(result)
+    result_json_str = result['candidates'][0]['content']['parts'][0]['text']
+    print(result_json_str)
+    result_dict = orjson.loads(result_json_str)
+    print(result_dict)
+    end_time = time.time()  # End timing
+    print(f"get time: {end_time - start_time} seconds")
+    return result_dict
+
+
+async def enrich(session, sem, payload):
+    async with sem:
+        try:
+            return await request_gemini(session, payload)
+        except Exception as e:
+            print(f"API request failed with exception {e}. Giving up on this job")
+            return {}
+
+
+async def enrich_all(payloads):
+    # A single shared session keeps connections alive across all requests
+    connector = aiohttp.TCPConnector(limit_per_host=concurrency)
+    async with aiohttp.ClientSession(connector=connector, json_serialize=lambda obj: orjson.dumps(obj).decode()) as session:
+        sem = asyncio.Semaphore(concurrency)
+        return await asyncio.gather(*(enrich(session, sem, payload) for payload in payloads))
+
 
 table_name = 'ja_jobs_raw'
+debug_csv = False  # also write human-readable .csv copies of the intermediate outputs
 engine = get_neon_engine()
 
 
+@retry(wait=wait_random_exponential(multiplier=5, max=60), stop=stop_after_attempt(5), reraise=True,
+       before_sleep=lambda retry_state: print(retry_state.outcome.exception()))
+def save_jobs(jobs):
+    jobs.to_sql(name=table_name, con=engine, if_exists='append', index=False, method=psql_insert_copy)
+
+
 try:
     jobs: pd.DataFrame = scrape_jobs(
         # site_name=["indeed", "linkedin", "zip_recruiter", "glassdoor"],
@@ -45,24 +179,21 @@ try:
     print(jobs.describe())
     print(jobs['date_posted'], jobs['title'], jobs['location'])
 
-    # Ensure date_posted is in datetime format
-    jobs['date_posted'] = pd.to_datetime(jobs['date_posted'])
-
-    # Populate null date_posted with current date
-    jobs['date_posted'] = jobs['date_posted'].fillna(pd.Timestamp.now().normalize())
-
-    print(jobs['date_posted'])
+    # Ensure date_posted is in datetime format, populating null/unparseable dates with current date
+    jobs['date_posted'] = pd.to_datetime(jobs['date_posted'], errors='coerce', cache=True).fillna(pd.Timestamp.now().normalize())
 
-    jobs['job_hash'] = jobs['job_url'].apply(hash_url)
+    jobs['job_hash'] = hash_urls(jobs['job_url'].values)
 
-    metadata = MetaData()
-    metadata.reflect(bind=engine)
-    if table_name in metadata.tables:
-        jobs_table = Table(table_name, metadata, autoload=True, autoload_with=engine)
-        sql = "select job_hash from " + table_name
-        df = pd.read_sql(sql, con=engine)
-        existing_job_hashes = set(df['job_hash'])
-        jobs = jobs[~jobs['job_hash'].isin(existing_job_hashes)]
+    with engine.begin() as conn:
+        if inspect(conn).has_table(table_name):
+            # Only look up the hashes just scraped instead of pulling every job_hash ever stored
+            # (served by the unique index from src/scripts/sql/ja_jobs_raw_job_hash_unique.sql)
+            sql = text("select job_hash from " + table_name + " where job_hash in :hashes")
+            sql = sql.bindparams(bindparam('hashes', expanding=True))
+            df = pd.read_sql(sql, con=conn, params={'hashes': jobs['job_hash'].tolist()})
+            existing_job_hashes = set(df['job_hash'])
+            jobs = jobs[~jobs['job_hash'].isin(existing_job_hashes)]
+    jobs = jobs.drop_duplicates(subset='job_hash')
 
     # formatting for pandas
     pd.set_option("display.max_columns", None)
@@ -73,150 +204,89 @@ try:
     # 1: output to console
     print(jobs)
     print(jobs.info())
-    print(jobs['date_posted'])
 
-    # 2: output to .csv
-    jobs.to_csv("./jobs.csv", index=False)
-    print("outputted to jobs.csv")
+    # 2: output to .parquet
+    jobs.to_parquet("./jobs.parquet", engine='pyarrow', compression='zstd', index=False)
+    print("outputted to jobs.parquet")
+    if debug_csv:
+        jobs.to_csv("./jobs.csv", index=False)
 
-    # jobs = pd.read_csv("./jobs.csv")
+    # jobs = pd.read_parquet("./jobs.parquet")
 
-    # Iterate over each row in the DataFrame
-    for index, row in jobs.iterrows():
-        # Extract relevant fields
-        title = row['title']
-        company = row['company']
-        location = row['location']
-        description = row['description']
-        company_url = row['company_url']
+    # Inferred values are filled into a plain object array and attached to jobs in one go after the loop
+    results = np.full((len(jobs), len(fields_list)), "", dtype=object)
 
-        input_text = str(title) + " " + str(company) + " " + str(location) + " " + str(description) + " " + str(company_url)
+    text_cols = jobs[['title', 'company', 'location', 'description', 'company_url']].fillna("").astype(str)
+    jobs['input_text'] = text_cols['title'].str.cat([text_cols[col] for col in text_cols.columns[1:]], sep=" ")
 
-        # Call Gemini API
-        start_time = time.time()  # Start timing
+    # Jobs without a usable description are left with empty inferred fields
+    enrichable = (jobs['description'].fillna("").astype(str).str.len() >= min_description_length).to_numpy()
+    print(f"skipping {len(jobs) - enrichable.sum()} jobs with a missing or short description")
 
+    # Identical postings (reposts, shared boilerplate) are only sent to Gemini once
+    hashes = []
+    pending = {}
+    for input_text, ok in zip(jobs['input_text'], enrichable):
+        if not ok:
+            hashes.append(None)
+            continue
         payload = {
-            "contents": [{"parts": [{"text": f"""  Extract and return these fields in a dictionary:
-                    1. country
-                    2.state
-                    3.city
-                    4.desired tech skills (as a list)
-                    5.desired soft skills (as a list)
-                    6.desired domain skills (as a list)
-                    7. domains (as a list)
-                    8.company sector
-                    9.position seniority level
-                    10. job type
-                    11. job title
-                    12. job description
-                    13. job requirements
-                    14. job responsibilities
-                    15. job benefits
-                    16. salary (if mentioned)
-                    18. company name (if mentioned)
-                    19. company description (if mentioned)
-                    20. company website (if mentioned)
-                    21. company size (if mentioned)
-                    22. company industry (if mentioned)
-                    23. company headquarters (if mentioned)
-                    24. company employees (if mentioned)
-                    25. company revenue (if mentioned)
-                    , from this text  - {input_text} """}]}]
+            "contents": [{"parts": [{"text": prompt_prefix + input_text + " "}]}],
+            "generationConfig": generation_config,
         }
+        h = prompt_hash(model, payload)
+        hashes.append(h)
+        pending.setdefault(h, payload)
+    # The cache is only an optimisation, a failing lookup just means every job is sent to Gemini
+    try:
+        cache = load_cached_results(engine, set(pending))
+    except Exception as e:
+        print(f"Failed to load cached results from {cache_table_name}: {e}")
+        cache = {}
+    print(f"{len(cache)} of {len(pending)} distinct jobs found in {cache_table_name}")
+    pending = {h: payload for h, payload in pending.items() if h not in cache}
+
+    new_results = dict(zip(pending, asyncio.run(enrich_all(list(pending.values())))))
+    new_results = {h: r for h, r in new_results.items() if r}
+    try:
+        save_cached_results(engine, new_results)
+    except Exception as e:
+        print(f"Failed to cache results in {cache_table_name}: {e}")
+    cache.update(new_results)
+    result_dicts = [cache.get(h, {}) for h in hashes]
+
+    for i, result_dict in enumerate(result_dicts):
+        for j, field in enumerate(fields_list):
+            if field not in result_dict:
+                continue
+            value = result_dict[field]
+            # Check if the value is a list
+            if isinstance(value, list):
+                # Convert the list to a string representation
+                try:
+                    value_str = ", ".join(str(item) for item in value)
+                except Exception as e:
+                    print(f"Error converting list {value} to string: {e}")
+                    value_str = "Unknown"
+                results[i, j] = value_str
+            else:
+                results[i, j] = str(value)
+
+    jobs = jobs.drop(columns=['input_text'])
+    jobs[suffix_cols] = results
+    print(jobs[suffix_cols])
 
-        try_count = 1
-        retry_delay = 5  # sleep for 5 seconds before retrying
-        while try_count < 5:
-            try:
-                response = requests.post(url, json=payload, headers=headers, params=params)
-                if response.status_code == 200:
-                    result = response.json()
-                    print(result)
-                    result_json_str = result['candidates'][0]['content']['parts'][0]['text']
-                    print(result_json_str)
-                    result_json_str = result_json_str.lstrip("```").rstrip("```")
-                    print(result_json_str)
-                    result_dict = json.loads(result_json_str)
-                    print(result_dict)
-                    end_time = time.time()  # End timing
-                    print(f"get time: {end_time - start_time} seconds")
-
-                    fields_list = [
-                                    'country',
-                                    'state',
-                                    'city',
-                                    'desired tech skills',
-                                    'desired soft skills',
-                                    'desired domain skills',
-                                    'domains',
-                                    'company sector',
-                                    'position seniority level',
-                                    'job type',
-                                    'job title',
-                                    'job description',
-                                    'job requirements',
-                                    'job responsibilities',
-                                    'job benefits',
-                                    'salary',
-                                    'company name',
-                                    'company description',
-                                    'company website',
-                                    'company size',
-                                    'company industry',
-                                    'company headquarters',
-                                    'company employees',
-                                    'company revenue'
-                                ]
-                    field_suffix_list = []
-                    for field in fields_list:
-                        field_suffix = field.replace(" ", "_") + "_inferred"
-                        if field not in result_dict:
-                            jobs.at[index, field_suffix] = ""
-                        else:
-                            value = result_dict[field]
-                            # Check if the value is a list
-                            if isinstance(value, list):
-                                # Convert the list to a string representation
-                                try:
-                                    value_str = ", ".join(str(item) for item in value)
-                                except Exception as e:
-                                    print(f"Error converting list {value} to string: {e}")
-                                    value_str = "Unknown"
-                                jobs.at[index, field_suffix] = value_str
-                            else:
-                                jobs.at[index, field_suffix] = str(value)
-                        field_suffix_list.append(field_suffix)
-                    print(jobs[field_suffix_list])
-                    break
-                else:
-                    print(f"API request failed with status code {response.status_code}. Retrying...")
-                    try_count += 1
-            except Exception as e:
-                print(f"API request failed with exception {e}. Retrying...")
-                time.sleep(retry_delay)
-                try_count += 1
-                retry_delay *= 2
-
-    print(jobs['date_posted'])
     print(jobs.info())
-    # 2: output to .csv
-    jobs.to_csv("./jobs_enriched.csv", index=False)
-    print("outputted to jobs.csv")
+    # 2: output to .parquet
+    jobs.to_parquet("./jobs_enriched.parquet", engine='pyarrow', compression='zstd', index=False)
+    print("outputted to jobs_enriched.parquet")
+    if debug_csv:
+        jobs.to_csv("./jobs_enriched.csv", index=False)
 
-    # jobs = pd.read_csv("./jobs_enriched.csv")
+    # jobs = pd.read_parquet("./jobs_enriched.parquet")
 
-    try_count = 1
-    retry_delay = 5  # sleep for 5 seconds before retrying
-    while try_count < 5:
-        try:
-            jobs.to_sql(name=table_name,con=engine, if_exists='append',index=False)
-            print("inserted to db")
-            break
-        except Exception as e:
-            print(e)
-            try_count += 1
-            time.sleep(retry_delay)
-            retry_delay *= 2
+    save_jobs(jobs)
+    print("inserted to db")
 
 except Exception as e:
     print(e)
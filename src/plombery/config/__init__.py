@@ -1,10 +1,12 @@
 import configparser
 import sys
 import os
+from functools import lru_cache
 
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(os.path.dirname(SCRIPT_DIR))
 
+@lru_cache(maxsize=1)
 def read_config():
     # Get the directory of the current script
     script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -12,8 +14,7 @@ def read_config():
     filename = os.path.join(script_dir, 'config.ini')
     config = configparser.ConfigParser()
     config.read(filename)
-    print(config.sections())
     return config
 
 if __name__ == '__main__':
-    read_config()
\ No newline at end of file
+    print(read_config().sections())
\ No newline at end of file
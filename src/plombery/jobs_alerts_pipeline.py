@@ -1,4 +1,5 @@
 from asyncio import sleep
+import asyncio
 from datetime import datetime
 import enum
 from typing import Optional
@@ -95,8 +96,7 @@ def send_alert_email(connection, server, email, alerts):
     msgtext = message.as_string()  # Converts the message to a string
     server.sendmail(sender_email, receiver_email, msgtext)  # Sends the email
 
-@task
-async def send_alert_emails():
+def send_alerts():
     # Database connection string
     engine = create_engine(connection_string)
     connection = engine.connect()
@@ -108,41 +108,35 @@ async def send_alert_emails():
     server.starttls()  # Encrypts the email
     server.login(Username, Password)  # Log in to server
 
-    # Fetch all subscriptions and group by email
+    # Fetch the last week's matching jobs for every subscriber in one query instead of one query per email
     query = text("""
-        SELECT email, country, job_title
-        FROM ja_job_alerts_subscriptions
+        SELECT DISTINCT s.email, j.date_posted, j.title, j.company, j.location, j.job_url, j.country_inferred
+        FROM ja_job_alerts_subscriptions s
+        JOIN ja_jobs_norm_vw j
+          ON j.job_title_inferred = s.job_title AND j.country_inferred = s.country
+        WHERE j.date_posted >= CURRENT_DATE - INTERVAL '7 DAY'
+        ORDER BY s.email, j.date_posted DESC
     """)
-    subscriptions = connection.execute(query).fetchall()
-
-    # Create a dictionary to store the grouped subscriptions
-    subscriptions_dict = {}
-    for sub in subscriptions:
-        if sub.email not in subscriptions_dict:
-            subscriptions_dict[sub.email] = []
-        subscriptions_dict[sub.email].append(sub)
-
-    # Fetch job alerts for each subscriber and send email
-    for email, subs in subscriptions_dict.items():
-        conditions = " OR ".join([
-            f"(job_title_inferred = '{sub.job_title}' AND country_inferred = '{sub.country}')"
-            for sub in subs
-        ])
-        query = text(f"""
-            SELECT distinct date_posted, title, company, location, job_url, country_inferred
-            FROM ja_jobs_norm_vw
-            WHERE ({conditions})
-            AND date_posted >= CURRENT_DATE - INTERVAL '7 DAY'
-            ORDER BY date_posted DESC
-        """)
-        alerts = connection.execute(query).fetchall()
-        if alerts:
-            send_alert_email(connection, server, email, alerts)
+    rows = connection.execute(query).fetchall()
+
+    # Group the alerts by email, rows stay ordered by date_posted within each subscriber
+    alerts_dict = {}
+    for row in rows:
+        alerts_dict.setdefault(row.email, []).append(row)
+
+    for email, alerts in alerts_dict.items():
+        send_alert_email(connection, server, email, alerts)
 
     server.quit()  # Terminates the server session
     connection.close()
     engine.dispose()
 
+
+@task
+async def send_alert_emails():
+    # The Neon query and the SMTP session are blocking, run them in a worker thread so the plombery event loop stays responsive
+    await asyncio.to_thread(send_alerts)
+
 class InputParams(BaseModel):
     """Showcase all the available input types in Plombery"""
 
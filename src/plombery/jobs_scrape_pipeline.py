@@ -1,4 +1,7 @@
 from asyncio import sleep
+import asyncio
+import aiohttp
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_random_exponential
 from datetime import datetime
 import enum
 from typing import Optional
@@ -11,19 +14,32 @@ from pydantic import BaseModel, Field
 from plombery import register_pipeline, task, Trigger, get_logger
 import random
 import mmh3
-import requests
 import time
 import json
+import orjson
 from jobspy import scrape_jobs
 import pandas as pd
-from sqlalchemy import create_engine, MetaData, Table, select
+import numpy as np
+from sqlalchemy import create_engine, MetaData, Table, select, text, bindparam
 import urllib.request
 from config import read_config
+from utils.pg_copy import psql_insert_copy
+from utils.gemini_cache import cache_table_name, prompt_hash, load_cached_results, save_cached_results
 import unicodedata
 import re
 
 
+json_decoder = json.JSONDecoder()
+
+# C0/C1 control characters, the only ones that normally show up in the Gemini responses
+control_chars_re = re.compile(r'[\x00-\x1f\x7f-\x9f]')
+
+
 def remove_control_characters(s):
+    s = control_chars_re.sub("", s)
+    if s.isprintable():
+        return s
+    # Rare case: other category C characters (format, private use, unassigned) left to strip one by one
     return "".join(ch for ch in s if unicodedata.category(ch)[0]!="C")
 
 
@@ -54,7 +70,8 @@ country_indeed_mapping = {
 
 
 # Set up the API request
-url = "https://generativelanguage.googleapis.com/v1beta/models/gemini-pro:generateContent"
+model = "gemini-pro"
+url = "https://generativelanguage.googleapis.com/v1beta/models/" + model + ":generateContent"
 
 # params = {'key': 'your_api_key'}  # Replace 'your_api_key' with the actual API key
 gemini_config = read_config()['GeminiPro']
@@ -62,28 +79,62 @@ API_KEY = gemini_config['API_KEY']
 
 params = {'key': API_KEY}  # Use the actual API key provided
 headers = {'Content-Type': 'application/json'}
+infer_concurrency = 8  # max in-flight Gemini requests
+
+# Fields asked from Gemini and the ja_jobs_raw columns they are stored in
+inferred_fields = [
+    'country',
+    'state',
+    'city',
+    'desired tech skills',
+    'desired soft skills',
+    'desired domain skills',
+    'domains',
+    'company sector',
+    'position seniority level',
+    'job type',
+    'job title',
+    'job description',
+    'job requirements',
+    'job responsibilities',
+    'job benefits',
+    'salary',
+    'company name',
+    'company description',
+    'company website',
+    'company size',
+    'company industry',
+    'company headquarters',
+    'company employees',
+    'company revenue'
+]
+inferred_field_suffixes = [field.replace(" ", "_") + "_inferred" for field in inferred_fields]
 
 neondb_config = read_config()['PostgresDB']
 connection_string = neondb_config['connection_string']
+# One pooled engine for the life of the plombery process; pre-ping replaces connections Neon closed while idle
+engine = create_engine(connection_string, pool_pre_ping=True)
 
 
 
 def save_to_db(table_name, df: pd.DataFrame):
-    engine = create_engine(connection_string)
-    df.to_sql(name=table_name, con=engine, if_exists='append', index=False)
-    engine.dispose()
+    df.to_sql(name=table_name, con=engine, if_exists='append', index=False, method=psql_insert_copy)
 
-def query_to_df(query) -> pd.DataFrame:
-    engine = create_engine(connection_string)
-    df = pd.read_sql_query(query, con=engine)
-    engine.dispose()
-    return df
+def query_to_df(query, params=None) -> pd.DataFrame:
+    return pd.read_sql_query(query, con=engine, params=params)
 
 
 def hash_url(url):
     return mmh3.hash(url, signed=False)
 
 
+_hash_url_ufunc = np.frompyfunc(hash_url, 1, 1)
+
+
+def hash_urls(urls):
+    return _hash_url_ufunc(urls).astype(np.int64)
+
+
 def get_raw_data() -> pd.DataFrame:
     # Get the current hour of the day
     current_hour = datetime.now().hour
@@ -112,16 +163,19 @@ def get_raw_data() -> pd.DataFrame:
             linkedin_fetch_description=True,
         )
 
-        jobs['job_hash'] = jobs['job_url'].apply(hash_url)
-        # Ensure date_posted is in datetime format
-        jobs['date_posted'] = pd.to_datetime(jobs['date_posted'])
-
-        # Populate null date_posted with current date
-        jobs['date_posted'] = jobs['date_posted'].fillna(pd.Timestamp.now().normalize())
-        jobs['is_deleted'] = 'N'
+        # Derived columns added in one assign rather than three separate inserts into the frame
+        jobs = jobs.assign(
+            job_hash=hash_urls(jobs['job_url'].values),
+            # Ensure date_posted is in datetime format, populating null/unparseable dates with current date
+            date_posted=pd.to_datetime(jobs['date_posted'], errors='coerce', cache=True).fillna(pd.Timestamp.now().normalize()),
+            is_deleted='N',
+        )
 
-        #Filter out duplicates
-        df = query_to_df("SELECT distinct job_hash FROM (SELECT job_hash FROM ja_jobs_raw_new union all SELECT job_hash FROM ja_jobs_raw) T")
+        #Filter out duplicates, checking only the hashes just scraped in a single round-trip
+        query = text("SELECT job_hash FROM ja_jobs_raw_new WHERE job_hash IN :hashes "
+                     "UNION SELECT job_hash FROM ja_jobs_raw WHERE job_hash IN :hashes")
+        query = query.bindparams(bindparam('hashes', expanding=True))
+        df = query_to_df(query, params={'hashes': jobs['job_hash'].tolist()})
         existing_job_hashes = set(df['job_hash'])
         jobs = jobs[~jobs['job_hash'].isin(existing_job_hashes)]
 
@@ -145,8 +199,9 @@ def get_raw_data() -> pd.DataFrame:
 @task
 async def get_jobs_data(params: InputParams) -> pd.DataFrame:
     try:
-        jobs: pd.DataFrame = get_raw_data()
-        save_to_db('ja_jobs_raw_new', jobs)
+        # Scraping and the COPY are blocking, run them in a worker thread so the plombery event loop stays responsive
+        jobs: pd.DataFrame = await asyncio.to_thread(get_raw_data)
+        await asyncio.to_thread(save_to_db, 'ja_jobs_raw_new', jobs)
 
         # inferred_jobs = infer_from_rawdata()
         # save_to_db('ja_jobs_raw', inferred_jobs)
@@ -156,8 +211,65 @@ async def get_jobs_data(params: InputParams) -> pd.DataFrame:
 
 
 
-def infer_from_rawdata() -> pd.DataFrame:
-    jobs = query_to_df("SELECT distinct * FROM ja_jobs_raw_new where job_hash not in (SELECT job_hash FROM ja_jobs_raw) order by date_posted desc limit 50")
+def log_retry(retry_state):
+    print(f"API request failed with exception {retry_state.outcome.exception()}. Retrying...")
+
+
+# Random exponential waits spread out the retries of concurrent requests (e.g. after a 429)
+@retry(wait=wait_random_exponential(multiplier=1, max=60), stop=stop_after_attempt(6), before_sleep=log_retry,
+       retry=retry_if_exception_type((aiohttp.ClientError, asyncio.TimeoutError, KeyError, ValueError)), reraise=True)
+async def request_inference(session, payload):
+    # Call Gemini API
+    start_time = time.time()  # Start timing
+    async with session.post(url, json=payload, headers=headers, params=params) as response:
+        response.raise_for_status()
+        result = orjson.loads(await response.read())
+    # print("result - ", result)
+    result_json_str = result['candidates'][0]['content']['parts'][0]['text']
+
+    # print("result_dict - ", result_json_str)
+    result_json_str = remove_control_characters(result_json_str)
+
+    # print("result_json_str 2 - ", result_json_str)
+    # Decode the first JSON object in the answer, ignoring any ```json fence or trailing text around it
+    result_dict, _ = json_decoder.raw_decode(result_json_str, result_json_str.index("{"))
+    # print("result_dict - ", result_dict)
+    end_time = time.time()  # End timing
+    print(f"get time: {end_time - start_time} seconds")
+    return result_dict
+
+
+async def infer_job(session, sem, h, payload):
+    async with sem:
+        try:
+            result_dict = await request_inference(session, payload)
+        except Exception as e:
+            print(f"API request failed with exception {e}. Giving up on this job")
+            return None
+    # Checkpoint each answer as it arrives, so a run cut short doesn't pay for the finished jobs again
+    try:
+        await asyncio.to_thread(save_cached_results, engine, {h: result_dict})
+    except Exception as e:
+        print(f"Failed to cache result {h}: {e}")
+    return result_dict
+
+
+async def infer_jobs(pending):
+    # One shared session so all requests reuse the same pooled connections
+    connector = aiohttp.TCPConnector(limit_per_host=infer_concurrency)
+    async with aiohttp.ClientSession(connector=connector, json_serialize=lambda obj: orjson.dumps(obj).decode()) as session:
+        sem = asyncio.Semaphore(infer_concurrency)
+        return await asyncio.gather(*(infer_job(session, sem, h, payload) for h, payload in pending.items()))
+
+
+async def infer_from_rawdata() -> pd.DataFrame:
+    # One row per job_hash (the latest scrape) rather than comparing whole rows with DISTINCT *
+    # Neon round trips run in a worker thread so they don't block the plombery event loop
+    jobs = await asyncio.to_thread(query_to_df, """SELECT * FROM (
+                            SELECT DISTINCT ON (jn.job_hash) jn.* FROM ja_jobs_raw_new jn
+                            WHERE NOT EXISTS (SELECT 1 FROM ja_jobs_raw jr WHERE jr.job_hash = jn.job_hash)
+                            ORDER BY jn.job_hash, jn.date_posted DESC
+                        ) T order by date_posted desc limit 50""")
     print("jobs count = ", str(len(jobs)))
 
     # Define key fields to check
@@ -168,24 +280,16 @@ def infer_from_rawdata() -> pd.DataFrame:
         'desired_tech_skills_inferred'
     ]
 
-    # Iterate over each row in the DataFrame
-    for index, row in jobs.iterrows():
-        # Extract relevant fields
-        title = row['title']
-        company = row['company']
-        location = row['location']
-        description = row['description']
-        company_url = row['company_url']
-
-        input_text = (str(title) + " " + str(company) + " " + str(location) + " " + str(description) + " " + str(
-            company_url)).replace("  ", " ").replace("\n", " ").replace("\t", " ")
-
-        input_text = re.sub('\s+', ' ', input_text)
+    # Join the text fields and collapse whitespace runs for the whole column at once
+    text_cols = jobs[['title', 'company', 'location', 'description', 'company_url']].fillna("").astype(str)
+    input_texts = text_cols['title'].str.cat([text_cols[col] for col in text_cols.columns[1:]], sep=" ")
+    input_texts = input_texts.str.replace(r'\s+', ' ', regex=True)
 
+    # Jobs already inferred by an earlier run (or repeated in this batch) are not sent again
+    hashes = []
+    pending = {}
+    for input_text in input_texts:
         # Set up the API request
-        # Call Gemini API
-        start_time = time.time()  # Start timing
-
         payload = {
             "contents": [{"parts": [{"text": f"""  Extract and return these fields in a dictionary:
                     1. country
@@ -214,82 +318,45 @@ def infer_from_rawdata() -> pd.DataFrame:
                     25. company revenue (if mentioned)
                     , from this text  - {input_text} """}]}]
         }
-
-        try_count = 1
-        retry_delay = 5  # sleep for 5 seconds before retrying
-        while try_count < 7:
-            try:
-                response = requests.post(url, json=payload, headers=headers, params=params)
-                if response.status_code == 200:
-                    result = response.json()
-                    # print("result - ", result)
-                    result_json_str = result['candidates'][0]['content']['parts'][0]['text']
-
-                    # print("result_dict - ", result_json_str)
-                    result_json_str = result_json_str.lstrip("```").rstrip("```")
-                    result_json_str = remove_control_characters(result_json_str)
-
-                    # print("result_json_str 2 - ", result_json_str)
-                    result_dict = json.loads(result_json_str)
-                    # print("result_dict - ", result_dict)
-                    end_time = time.time()  # End timing
-                    print(f"get time: {end_time - start_time} seconds")
-
-                    fields_list = [
-                        'country',
-                        'state',
-                        'city',
-                        'desired tech skills',
-                        'desired soft skills',
-                        'desired domain skills',
-                        'domains',
-                        'company sector',
-                        'position seniority level',
-                        'job type',
-                        'job title',
-                        'job description',
-                        'job requirements',
-                        'job responsibilities',
-                        'job benefits',
-                        'salary',
-                        'company name',
-                        'company description',
-                        'company website',
-                        'company size',
-                        'company industry',
-                        'company headquarters',
-                        'company employees',
-                        'company revenue'
-                    ]
-                    field_suffix_list = []
-                    for field in fields_list:
-                        field_suffix = field.replace(" ", "_") + "_inferred"
-                        if field not in result_dict:
-                            jobs.at[index, field_suffix] = ""
-                        else:
-                            value = result_dict[field]
-                            # Check if the value is a list
-                            if isinstance(value, list):
-                                # Convert the list to a string representation
-                                try:
-                                    value_str = ", ".join(str(item) for item in value)
-                                except Exception as e:
-                                    print(f"Error converting list {value} to string: {e}")
-                                    value_str = "Unknown"
-                                jobs.at[index, field_suffix] = value_str
-                            else:
-                                jobs.at[index, field_suffix] = str(value)
-                        field_suffix_list.append(field_suffix)
-                    # print(jobs[field_suffix_list])
-                    break
+        h = prompt_hash(model, payload)
+        hashes.append(h)
+        pending.setdefault(h, payload)
+    # The cache is only an optimisation, a failing lookup just means every job is sent to Gemini
+    try:
+        cache = await asyncio.to_thread(load_cached_results, engine, set(pending))
+    except Exception as e:
+        print(f"Failed to load cached results from {cache_table_name}: {e}")
+        cache = {}
+    print(f"{len(cache)} of {len(pending)} distinct jobs found in {cache_table_name}")
+    pending = {h: payload for h, payload in pending.items() if h not in cache}
+
+    # Requests run concurrently, bounded by infer_concurrency
+    pending_results = dict(zip(pending, await infer_jobs(pending)))
+    cache.update({h: r for h, r in pending_results.items() if r is not None and r.get('job title')})
+    result_dicts = [cache.get(h, pending_results.get(h)) for h in hashes]
+
+    # Jobs whose inference failed keep None in every column and are filtered out below
+    inferred_cols = {field_suffix: [None] * len(jobs) for field_suffix in inferred_field_suffixes}
+    for i, result_dict in enumerate(result_dicts):
+        if result_dict is None:
+            continue
+        for field, field_suffix in zip(inferred_fields, inferred_field_suffixes):
+            if field not in result_dict:
+                inferred_cols[field_suffix][i] = ""
+            else:
+                value = result_dict[field]
+                # Check if the value is a list
+                if isinstance(value, list):
+                    # Convert the list to a string representation
+                    try:
+                        value_str = ", ".join(str(item) for item in value)
+                    except Exception as e:
+                        print(f"Error converting list {value} to string: {e}")
+                        value_str = "Unknown"
+                    inferred_cols[field_suffix][i] = value_str
                 else:
-                    print(f"API request failed with status code {response.status_code}. Retrying...")
-                    try_count += 1
-            except Exception as e:
-                print(f"API request failed with exception {e}. Retrying...")
-                time.sleep(retry_delay)
-                try_count += 1
-                retry_delay *= 2
+                    inferred_cols[field_suffix][i] = str(value)
+    jobs = jobs.assign(**inferred_cols)
 
     # Filter out records where any key field is not inferred
     # for field in key_fields:
@@ -302,8 +369,8 @@ def infer_from_rawdata() -> pd.DataFrame:
 
 @task
 async def ai_infer_raw_data():
-    inferred_jobs = infer_from_rawdata()
-    save_to_db('ja_jobs_raw', inferred_jobs)
+    inferred_jobs = await infer_from_rawdata()
+    await asyncio.to_thread(save_to_db, 'ja_jobs_raw', inferred_jobs)
 
 
 
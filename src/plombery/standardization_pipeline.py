@@ -1,4 +1,5 @@
 from asyncio import sleep
+import asyncio
 from datetime import datetime
 import enum
 from typing import Optional
@@ -66,13 +67,14 @@ def results_to_csv(results):
     return res
 
 def insert_mapping_to_db(mappings, mapping_table):
-    # Assuming you have a database connection and a table named 'mapping_table'
-    for source_value, target_value in mappings.items():
-        print("inserting ", source_value, target_value)
-        query = text(f"INSERT INTO {mapping_table} (source_value, target_value) VALUES ('{source_value}', '{target_value}')")
-        print("insert query = ", query)
-        execute_query(query)
-        print("done inserting ", source_value, target_value)
+    # Insert all the mappings in one batched statement instead of one transaction per row
+    if not mappings:
+        return
+    print("inserting ", len(mappings), " mappings into ", mapping_table)
+    query = text(f"INSERT INTO {mapping_table} (source_value, target_value) VALUES (:source_value, :target_value)")
+    execute_query(query, [{'source_value': source_value, 'target_value': target_value}
+                          for source_value, target_value in mappings.items()])
+    print("done inserting ", len(mappings), " mappings")
 
 @task
 async def standardize_dims():
@@ -80,12 +82,12 @@ async def standardize_dims():
 
     for dim in dims:
         query = dim['query_source_values_to_std']
-        source_values_to_std = execute_query(query)
+        source_values_to_std = await asyncio.to_thread(execute_query, query)
         source_values_to_std_csv = results_to_csv(source_values_to_std)
 
         query = dim['query_std_values']
         mapping_table = dim['table']
-        target_values = execute_query(query)
+        target_values = await asyncio.to_thread(execute_query, query)
         target_values_csv = results_to_csv(target_values)
 
         if source_values_to_std_csv != '' and target_values_csv != '':
@@ -96,10 +98,11 @@ async def standardize_dims():
                         Give the output as a proper JSON string format  """}]}],
             }
             print(payload)
-            new_mappings = infer(payload)
+            # infer() blocks on the HTTP call and its retry sleeps, keep it off the event loop
+            new_mappings = await asyncio.to_thread(infer, payload)
 
             print(new_mappings)
-            insert_mapping_to_db(new_mappings, mapping_table)
+            await asyncio.to_thread(insert_mapping_to_db, new_mappings, mapping_table)
 
             print("done")
 
@@ -1,6 +1,6 @@
 import requests
 import time
-import json
+import orjson
 from config import read_config
 
 # Set up the API request
@@ -14,6 +14,13 @@ API_KEY = gemini_config['API_KEY']
 params = {'key': API_KEY}  # Use the actual API key provided
 headers = {'Content-Type': 'application/json'}
 
+# Reused across infer() calls so the TLS connection to the API stays open between requests
+session = requests.Session()
+session.headers.update(headers)
+
+# Newlines/tabs the model puts inside JSON string values are invalid JSON, drop them in one pass
+strip_control_chars = str.maketrans("", "", "\n\t\r")
+
 
 def infer(payload):
     try_count = 1
@@ -24,15 +31,16 @@ def infer(payload):
             # Call Gemini API
             start_time = time.time()  # Start timing
 
-            response = requests.post(url, json=payload, headers=headers, params=params)
+            response = session.post(url, data=orjson.dumps(payload), params=params)
             if response.status_code == 200:
-                result = response.json()
+                result = orjson.loads(response.content)
                 # print(result)
                 result_json_str = result['candidates'][0]['content']['parts'][0]['text']
                 # print(result_json_str)
-                result_json_str = result_json_str.lstrip("```").rstrip("```").replace("json", "").replace("\n", "").replace("\t", "").replace("\r", "")
+                result_json_str = result_json_str.strip().removeprefix("```json").removeprefix("```").removesuffix("```")
+                result_json_str = result_json_str.translate(strip_control_chars)
                 # print(result_json_str)
-                result_dict = json.loads(result_json_str)
+                result_dict = orjson.loads(result_json_str)
                 # print(result_dict)
                 end_time = time.time()  # End timing
                 print(f"get time: {end_time - start_time} seconds")
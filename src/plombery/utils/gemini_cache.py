@@ -0,0 +1,33 @@
+import mmh3
+import orjson
+from sqlalchemy import text, bindparam
+
+# Gemini results keyed by a hash of the model and request, shared by main.py and the plombery pipeline
+# (the table is created by src/scripts/sql/ja_gemini_cache.sql)
+cache_table_name = 'ja_gemini_cache'
+
+
+def prompt_hash(model, payload):
+    # Keyed on the model and the whole request (prompt, response schema), so callers with different
+    # prompts or models never share answers and a prompt change doesn't reuse stale ones
+    return str(mmh3.hash128(model.encode() + b"\n" + orjson.dumps(payload, option=orjson.OPT_SORT_KEYS), signed=False))
+
+
+def load_cached_results(engine, hashes):
+    if not hashes:
+        return {}
+    with engine.begin() as conn:
+        query = text("SELECT prompt_hash, result FROM " + cache_table_name + " WHERE prompt_hash IN :hashes")
+        query = query.bindparams(bindparam('hashes', expanding=True))
+        return {row.prompt_hash: row.result for row in conn.execute(query, {'hashes': list(hashes)})}
+
+
+def save_cached_results(engine, new_results):
+    # Answers without a job title are retried on the next run instead of being cached
+    new_results = {h: r for h, r in new_results.items() if isinstance(r, dict) and r.get('job title')}
+    if not new_results:
+        return
+    query = text("INSERT INTO " + cache_table_name + " (prompt_hash, result) VALUES (:prompt_hash, CAST(:result AS JSONB))"
+                 " ON CONFLICT (prompt_hash) DO NOTHING")
+    with engine.begin() as conn:
+        conn.execute(query, [{'prompt_hash': h, 'result': orjson.dumps(r).decode()} for h, r in new_results.items()])
@@ -0,0 +1,22 @@
+import csv
+from io import StringIO
+
+null_sentinel = '\\N'
+
+
+def psql_insert_copy(table, conn, keys, data_iter):
+    """to_sql insertion method that streams the rows through Postgres COPY, skipping rows that hit a unique index"""
+    dbapi_conn = conn.connection
+    with dbapi_conn.cursor() as cur:
+        # csv writes None and '' the same way, so NULLs go out as a \N sentinel to keep empty strings as ''
+        buf = StringIO()
+        csv.writer(buf).writerows([null_sentinel if v is None else v for v in row] for row in data_iter)
+        buf.seek(0)
+
+        columns = ', '.join('"{}"'.format(k) for k in keys)
+        table_ref = '{}.{}'.format(table.schema, table.name) if table.schema else table.name
+        staging_ref = '"{}_staging"'.format(table.name)
+        cur.execute('CREATE TEMP TABLE {} (LIKE {} INCLUDING DEFAULTS)'.format(staging_ref, table_ref))
+        cur.copy_expert("COPY {} ({}) FROM STDIN WITH (FORMAT csv, NULL '{}')".format(staging_ref, columns, null_sentinel), buf)
+        cur.execute('INSERT INTO {0} ({1}) SELECT {1} FROM {2} ON CONFLICT DO NOTHING'.format(table_ref, columns, staging_ref))
+        cur.execute('DROP TABLE {}'.format(staging_ref))
@@ -24,22 +24,25 @@ import smtplib
 from sqlalchemy import text
 from sqlalchemy.exc import SQLAlchemyError
 from config import read_config
+from functools import lru_cache
 
 
+@lru_cache(maxsize=1)
 def _get_engine():
+    # Built once and shared, so execute_query reuses pooled connections instead of reconnecting every call
     neondb_config = read_config()['PostgresDB']
     connection_string = neondb_config['connection_string']
-    return create_engine(connection_string)
+    return create_engine(connection_string, pool_pre_ping=True)
 
 
 
-def execute_query(query):
+def execute_query(query, params=None):
     engine = _get_engine()
     connection = engine.connect()
     transaction = connection.begin()  # Start a transaction
 
     try:
-        results = connection.execute(query)
+        results = connection.execute(query, params)  # a list of param dicts runs as a single executemany
         transaction.commit()  # Commit the transaction if no errors occur
         if results.returns_rows:
             return results.fetchall()  # Fetch results if there are any
@@ -54,10 +57,12 @@ def execute_query(query):
         return None
     finally:
         connection.close()
-        engine.dispose()
 
-# Example usage
-query = "INSERT INTO ja_country_names_std_mapping (source_value, target_value) VALUES ('AZ, AE', 'Dubai')"
-execute_query(query)
+
+if __name__ == '__main__':
+    # Example usage
+    query = "INSERT INTO ja_country_names_std_mapping (source_value, target_value) VALUES ('AZ, AE', 'Dubai')"
+    execute_query(query)
+
 
 
@@ -0,0 +1,6 @@
+-- One-off migration: Gemini answers shared by src/main.py and the plombery jobs pipeline,
+-- keyed by utils/gemini_cache.prompt_hash (a hash of the model and the full request)
+CREATE TABLE IF NOT EXISTS ja_gemini_cache (
+    prompt_hash TEXT PRIMARY KEY,
+    result JSONB NOT NULL
+);
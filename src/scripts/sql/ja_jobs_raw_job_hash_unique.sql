@@ -0,0 +1,18 @@
+-- One-off migration: make job_hash unique on ja_jobs_raw so psql_insert_copy's ON CONFLICT DO NOTHING
+-- skips jobs that are already stored. Run with psql in autocommit mode (CONCURRENTLY can't run inside a transaction).
+
+-- Remove duplicate job_hash rows left by earlier runs, keeping the one with the latest date_posted
+-- (duplicates with the same date_posted are identical scrapes, which of those survives is arbitrary)
+DELETE FROM ja_jobs_raw
+WHERE ctid IN (
+    SELECT ctid FROM (
+        SELECT ctid, row_number() OVER (PARTITION BY job_hash ORDER BY date_posted DESC NULLS LAST) AS rn
+        FROM ja_jobs_raw
+        WHERE job_hash IS NOT NULL
+    ) d
+    WHERE d.rn > 1
+);
+
+-- Build the unique index without blocking the pipelines' inserts
+-- (if this fails it leaves an INVALID index behind: DROP INDEX CONCURRENTLY ux_ja_jobs_raw_job_hash and rerun)
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS ux_ja_jobs_raw_job_hash ON ja_jobs_raw (job_hash);
@@ -1,12 +1,12 @@
 import streamlit as st
 import pandas as pd
-from jobs_data import load_dataframe
+from jobs_data import load_dataframe, get_engine
 import sys
 import os
 import altair as alt
 import streamlit as st
 from st_aggrid import AgGrid, GridOptionsBuilder, GridUpdateMode, DataReturnMode
-from sqlalchemy import create_engine, MetaData, Table, Column, String, DateTime
+from sqlalchemy import MetaData, Table, Column, String, DateTime
 import re
 from datetime import datetime
 
@@ -22,9 +22,8 @@ def validate_email(email):
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(os.path.dirname(SCRIPT_DIR))
 
-# Database connection
-connection_string = st.secrets.PostgresDB.connection_string
-engine = create_engine(connection_string)
+# Database connection, reused across reruns instead of a new engine on every interaction
+engine = get_engine()
 
 # Initialize metadata object
 metadata = MetaData()
@@ -38,8 +37,12 @@ ja_job_alerts_subscriptions = Table(
     Column('insert_timestamp', DateTime),
 )
 
-# Create the table if it doesn't exist
-metadata.create_all(engine)
+# Create the table if it doesn't exist, checked once per server rather than on every rerun
+@st.cache_resource
+def create_tables():
+    metadata.create_all(engine)
+
+create_tables()
 
 st.set_page_config(
     page_title="Data Job Listings Dashboard",
@@ -111,17 +114,16 @@ with col2:
                 if not validate_email(email):
                     st.error("Invalid email format. Please enter a valid email address.")
                 else:
-                    # Logic to save data to the database
-                    for each_country in country:
-                        for each_title in job_title:
-                            try:
-                                with engine.begin() as connection:
-                                    insert_statement = ja_job_alerts_subscriptions.insert().values(
-                                        email=email, country=each_country, job_title=each_title, insert_timestamp=datetime.now()
-                                    )
-                                    connection.execute(insert_statement)
-                            except Exception as e:
-                                print("Failed to insert data:", e)
+                    # Logic to save data to the database, all (country, job title) pairs in one executemany and transaction
+                    insert_timestamp = datetime.now()
+                    subscriptions = [dict(email=email, country=each_country, job_title=each_title, insert_timestamp=insert_timestamp)
+                                     for each_country in country for each_title in job_title]
+                    if subscriptions:
+                        try:
+                            with engine.begin() as connection:
+                                connection.execute(ja_job_alerts_subscriptions.insert(), subscriptions)
+                        except Exception as e:
+                            print("Failed to insert data:", e)
                     st.success(f"{email} Subscribed successfully For {country} And {job_title} Job Alerts!", icon="✅")
 
 # Another markdown divider for neatness
@@ -162,8 +164,7 @@ with col2:
 
 
 
-# Ensure 'Date Posted' is a datetime type for proper resampling
-df['Date Posted'] = pd.to_datetime(df['Date Posted'])
+# 'Date Posted' is already datetime64 (load_dataframe converts date_posted once, inside its cache), ready for resampling
 
 # Sort dataframe by date to ensure correct slicing
 df = df.sort_values('Date Posted')
@@ -217,5 +218,3 @@ grid_response = AgGrid(
 # updated_df = grid_response['data']
 # st.write("Updated DataFrame:")
 # st.dataframe(updated_df)
-
-engine.dispose()
\ No newline at end of file
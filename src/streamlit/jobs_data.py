@@ -5,32 +5,12 @@ import pandas as pd
 
 sqlQuery = """
 				SELECT distinct
-                  site, 
+                  -- only the columns the dashboard pages use; description etc. stay in the database
                   job_url, 
-                  job_url_direct, 
                   title, 
                   company, 
                   "location", 
-                  job_type, 
                   date_posted, 
-                  "interval", 
-                  min_amount, 
-                  max_amount, 
-                  currency, 
-                  is_remote, 
-                  emails, 
-                  description, 
-                  company_url, 
-                  company_url_direct, 
-                  company_addresses, 
-                  company_industry, 
-                  company_num_employees, 
-                  company_revenue, 
-                  company_description, 
-                  logo_photo_url, 
-                  banner_photo_url, 
-                  ceo_name, 
-                  ceo_photo_url, 
                   jr.job_hash, 
                   jcm.target_value as country_inferred, 
                   state_inferred, 
@@ -39,24 +19,7 @@ sqlQuery = """
                   desired_soft_skills_inferred, 
                   desired_domain_skills_inferred, 
                   domains_inferred, 
-                  company_sector_inferred, 
-                  position_seniority_level_inferred, 
-                  job_type_inferred, 
-                  jjt.target_value job_title_inferred, 
-                  job_description_inferred, 
-                  job_requirements_inferred, 
-                  job_responsibilities_inferred, 
-                  job_benefits_inferred, 
-                  salary_inferred, 
-                  company_name_inferred, 
-                  company_description_inferred, 
-                  company_website_inferred, 
-                  company_size_inferred, 
-                  company_industry_inferred, 
-                  company_headquarters_inferred, 
-                  company_employees_inferred, 
-                  company_revenue_inferred, 
-                  "company industry" 
+                  jjt.target_value job_title_inferred 
                 FROM 
                   ja_jobs_raw jr 
                 left outer join ja_country_names_std_mapping jcm on upper(trim(jr.country_inferred)) = upper(trim(jcm.source_value))
@@ -75,24 +38,27 @@ sqlQuery = """
 def filter_invalid_records(df):
 
     # Filter out listings where the country is 'None'
-    df = df[df['country_inferred'].notnull() & (df['country_inferred'] != 'None')]
+    valid_country = df['country_inferred'].notnull() & (df['country_inferred'] != 'None')
 
     # Filter invalid job titles
-    df = df[df['job_title_inferred'].notnull() & (df['job_title_inferred'] != 'None') & (df['job_title_inferred'] != 'Other')]
+    valid_title = df['job_title_inferred'].notnull() & ~df['job_title_inferred'].isin(['None', 'Other'])
 
-    return df
+    # Combine the masks so the frame is copied once
+    return df[valid_country & valid_title]
+
+@st.cache_resource
+def get_engine():
+    # One pooled engine per Streamlit server, shared by every session and script rerun
+    connection_string = st.secrets.PostgresDB.connection_string
+    return create_engine(connection_string, pool_pre_ping=True)
 
 # @st.cache(allow_output_mutation=True)
 @st.cache_data(ttl=86400)
 def load_dataframe(sql=sqlQuery):
-    connection_string = st.secrets.PostgresDB.connection_string
-    engine = create_engine(connection_string)
-    SQL_Query = pd.read_sql(sql, engine)
-    df = pd.DataFrame(SQL_Query)
+    df = pd.read_sql(sql, get_engine())
     df['date_posted'] = pd.to_datetime(df['date_posted'],
                                        errors='coerce')  # Use 'coerce' to handle any invalid parsing as NaT
     df = df.dropna(subset=['date_posted'])  # Optional: Remove rows where conversion failed
-    engine.dispose()
 
     df = filter_invalid_records(df)
     return df
@@ -6,16 +6,12 @@ from jobs_data import load_dataframe
 # Load and prepare the data
 df = load_dataframe()
 df = df[df['desired_tech_skills_inferred'].notna() & (df['desired_tech_skills_inferred'] != '')]
-# Ensure the desired_tech_skills_inferred column is a list; if not, split it
-df['desired_tech_skills_inferred'] = df['desired_tech_skills_inferred'].apply(lambda x: x if isinstance(x, list) else str(x).split(','))
+# Split the comma separated skills into lists and explode the DataFrame on the desired_tech_skills_inferred column
+df_exploded = df.assign(desired_tech_skills_inferred=df['desired_tech_skills_inferred'].astype(str).str.split(','))
+df_exploded = df_exploded.explode('desired_tech_skills_inferred')
 
-# Normalize skill names: convert to lowercase, strip spaces, and then capitalize
-df['desired_tech_skills_inferred'] = df['desired_tech_skills_inferred'].apply(
-    lambda skills: [skill.lower().strip().capitalize() for skill in skills]
-)
-
-# Explode the DataFrame on the desired_tech_skills_inferred column
-df_exploded = df.explode('desired_tech_skills_inferred')
+# Normalize skill names on the exploded column at once: strip spaces, then capitalize (which lowercases the rest)
+df_exploded['desired_tech_skills_inferred'] = df_exploded['desired_tech_skills_inferred'].str.strip().str.capitalize()
 
 # Count the occurrences of each skill
 skill_counts = df_exploded['desired_tech_skills_inferred'].value_counts().reset_index()
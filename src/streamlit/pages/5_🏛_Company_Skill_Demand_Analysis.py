@@ -7,8 +7,7 @@ from jobs_data import load_dataframe
 df = load_dataframe()
 
 # Ensure the skills column is in list form and explode it
-df['desired_tech_skills_inferred'] = df['desired_tech_skills_inferred'].apply(
-    lambda x: x.split(',') if isinstance(x, str) else [])
+df['desired_tech_skills_inferred'] = df['desired_tech_skills_inferred'].str.split(',')  # missing values stay NaN and explode to NaN
 df_exploded = df.explode('desired_tech_skills_inferred')
 
 
@@ -91,15 +90,20 @@ def display_companies_for_top_skills(data, top_n=5):
 
     tab_list = st.tabs([f"{skill}" for skill in skill_counts['Skill']])
 
+    # Aggregate all the top skills in one groupby instead of re-scanning the whole frame for every tab
+    top_skills_df = data[data['desired_tech_skills_inferred'].isin(skill_counts['Skill'])]
+    skills_aggregated = top_skills_df.groupby(['desired_tech_skills_inferred', 'company']).agg({
+        'job_hash': 'count',  # Count the number of job listings
+        'job_title_inferred': lambda x: ', '.join(x.unique())  # Concatenate unique job titles into a comma-separated string
+    })
+
     for tab, skill in zip(tab_list, skill_counts['Skill']):
         with tab:
-            skill_df = data[data['desired_tech_skills_inferred'] == skill]
-
-            # Aggregating job listings by company and concatenating unique job titles
-            company_aggregated = skill_df.groupby('company').agg({
-                'job_hash': 'count',  # Count the number of job listings
-                'job_title_inferred': lambda x: ', '.join(x.unique())  # Concatenate unique job titles into a comma-separated string
-            }).reset_index()
+            if skill in skills_aggregated.index:
+                company_aggregated = skills_aggregated.loc[skill].reset_index()
+            else:
+                # groupby drops null companies, so a skill only listed without a company gets an empty table
+                company_aggregated = pd.DataFrame(columns=['company', 'job_hash', 'job_title_inferred'])
             company_aggregated.columns = ['Company', 'Job Listings', 'Job Titles']
 
             # Sorting the aggregated data by 'Job Listings' in descending order